@@ -5,6 +5,8 @@ Uses AES-256-GCM for encryption/decryption.
 
 import base64
 import os
+from functools import lru_cache
+from typing import Optional, Union
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 
@@ -14,49 +16,168 @@ def generate_master_key() -> bytes:
     return AESGCM.generate_key(bit_length=256)
 
 
-def encrypt_aes_gcm(key: bytes, plaintext: str) -> tuple[str, str]:
+@lru_cache(maxsize=32)
+def _get_cipher(key: bytes) -> AESGCM:
+    """
+    Get a cached AESGCM instance for key.
+    
+    Building an AESGCM runs the AES key schedule, so we do it once per key
+    and reuse the instance. Callers should keep passing the same key bytes
+    (e.g. from KMSState) to hit the cache.
+    """
+    return AESGCM(key)
+
+
+def _resolve_cipher(key: Union[bytes, AESGCM]) -> AESGCM:
+    """Return the AESGCM for key, which may already be a prebuilt AESGCM."""
+    if isinstance(key, AESGCM):
+        return key
+    if len(key) != 32:
+        raise ValueError("Key must be 32 bytes for AES-256")
+    return _get_cipher(key)
+
+
+def _encrypt_raw(aesgcm: AESGCM, nonce: bytes, plaintext_bytes: bytes) -> bytes:
+    """Run the AEAD encryption for a single message (no associated data)."""
+    return aesgcm.encrypt(nonce, plaintext_bytes, None)
+
+
+def check_aes_acceleration() -> Optional[bool]:
+    """
+    Check whether the CPU advertises AES-NI, printing a warning if not.
+    
+    Only Linux exposes CPU flags in a portable way (/proc/cpuinfo); on other
+    platforms this returns None without warning.
+    
+    Returns:
+        True if AES-NI is available, False if not, None if unknown
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+    except OSError:
+        return None
+    
+    # x86 reports "aes" in the flags line, ARMv8 in the Features line
+    has_aes = any(
+        line.split(":", 1)[0].strip() in ("flags", "Features") and " aes" in line
+        for line in cpuinfo.splitlines()
+    )
+    if not has_aes:
+        from cryptography.hazmat.backends.openssl import backend
+        print(f"Warning: CPU does not report AES-NI; AES-GCM will run in software "
+              f"({backend.openssl_version_text()})")
+    return has_aes
+
+
+def encrypt_aes_gcm_raw(key: Union[bytes, AESGCM], plaintext_bytes: bytes) -> tuple[bytes, bytes]:
+    """
+    Encrypt raw bytes using AES-256-GCM, without any base64 wrapping.
+    
+    Use this when the caller already has bytes and doesn't need text;
+    base64 should only be applied at the storage/transport boundary.
+    
+    Args:
+        key: 32-byte encryption key, or a prebuilt AESGCM for it
+        plaintext_bytes: Bytes to encrypt
+        
+    Returns:
+        Tuple of (ciphertext, nonce) as raw bytes
+    """
+    aesgcm = _resolve_cipher(key)
+    nonce = os.urandom(12)
+    ciphertext = _encrypt_raw(aesgcm, nonce, plaintext_bytes)
+    return ciphertext, nonce
+
+
+def decrypt_aes_gcm_raw(key: Union[bytes, AESGCM], ciphertext: bytes, nonce: bytes) -> bytes:
+    """
+    Decrypt raw AES-256-GCM ciphertext bytes.
+    
+    Args:
+        key: 32-byte decryption key, or a prebuilt AESGCM for it
+        ciphertext: Raw ciphertext (with GCM tag appended)
+        nonce: Raw 12-byte nonce
+        
+    Returns:
+        Decrypted plaintext bytes
+    """
+    aesgcm = _resolve_cipher(key)
+    try:
+        return aesgcm.decrypt(nonce, ciphertext, None)
+    except Exception as e:
+        raise ValueError(f"Decryption failed: {e}")
+
+
+def encrypt_aes_gcm(key: Union[bytes, AESGCM], plaintext: str) -> tuple[str, str]:
     """
     Encrypt plaintext using AES-256-GCM.
     
     Args:
-        key: 32-byte encryption key
+        key: 32-byte encryption key, or a prebuilt AESGCM for it
         plaintext: String to encrypt
         
     Returns:
         Tuple of (ciphertext_b64, nonce_b64) as base64 strings
     """
-    if len(key) != 32:
-        raise ValueError("Key must be 32 bytes for AES-256")
+    return encrypt_many(key, [plaintext])[0]
+
+
+def encrypt_many(key: Union[bytes, AESGCM], plaintexts: list[Union[str, bytes]]) -> list[tuple[str, str]]:
+    """
+    Encrypt several plaintexts with the same key using AES-256-GCM.
     
-    # Generate 12-byte nonce for GCM (random bytes)
-    nonce = os.urandom(12)
+    The cipher is looked up once and all nonces come from a single
+    os.urandom call, so per-message overhead stays low for batches.
+    
+    Args:
+        key: 32-byte encryption key, or a prebuilt AESGCM for it
+        plaintexts: Strings (encoded as UTF-8) or already-encoded bytes to encrypt
+        
+    Returns:
+        List of (ciphertext_b64, nonce_b64) tuples, in input order
+    """
+    aesgcm = _resolve_cipher(key)
+    
+    n = len(plaintexts)
+    if n == 0:
+        return []
+    
+    # Generate all 12-byte GCM nonces (random bytes) in one call
+    nonce_pool = os.urandom(12 * n)
+    # 12 bytes is a multiple of 3, so the pool encodes to exactly 16 base64
+    # chars per nonce and can be sliced without re-encoding each one
+    nonce_pool_b64 = base64.b64encode(nonce_pool).decode('ascii')
     
-    # Create cipher and encrypt
-    aesgcm = AESGCM(key)
-    plaintext_bytes = plaintext.encode('utf-8')
-    ciphertext = aesgcm.encrypt(nonce, plaintext_bytes, None)
+    b64encode = base64.b64encode
     
-    # Return base64-encoded strings
-    ciphertext_b64 = base64.b64encode(ciphertext).decode('utf-8')
-    nonce_b64 = base64.b64encode(nonce).decode('utf-8')
+    results = []
+    for i, plaintext in enumerate(plaintexts):
+        nonce = nonce_pool[i * 12:(i + 1) * 12]
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+        ciphertext = _encrypt_raw(aesgcm, nonce, plaintext)
+        results.append((
+            b64encode(ciphertext).decode('ascii'),
+            nonce_pool_b64[i * 16:(i + 1) * 16],
+        ))
     
-    return ciphertext_b64, nonce_b64
+    return results
 
 
-def decrypt_aes_gcm(key: bytes, ciphertext_b64: str, nonce_b64: str) -> str:
+def decrypt_aes_gcm(key: Union[bytes, AESGCM], ciphertext_b64: str, nonce_b64: str) -> str:
     """
     Decrypt ciphertext using AES-256-GCM.
     
     Args:
-        key: 32-byte decryption key
+        key: 32-byte decryption key, or a prebuilt AESGCM for it
         ciphertext_b64: Base64-encoded ciphertext
         nonce_b64: Base64-encoded nonce
         
     Returns:
         Decrypted plaintext string
     """
-    if len(key) != 32:
-        raise ValueError("Key must be 32 bytes for AES-256")
+    aesgcm = _resolve_cipher(key)
     
     # Decode base64
     try:
@@ -66,10 +187,9 @@ def decrypt_aes_gcm(key: bytes, ciphertext_b64: str, nonce_b64: str) -> str:
         raise ValueError(f"Invalid base64 encoding: {e}")
     
     # Decrypt
-    aesgcm = AESGCM(key)
+    plaintext_bytes = decrypt_aes_gcm_raw(aesgcm, ciphertext, nonce)
     try:
-        plaintext_bytes = aesgcm.decrypt(nonce, ciphertext, None)
         return plaintext_bytes.decode('utf-8')
-    except Exception as e:
+    except UnicodeDecodeError as e:
         raise ValueError(f"Decryption failed: {e}")
 
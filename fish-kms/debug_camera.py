@@ -5,11 +5,20 @@ Shows live camera feed with motion tracking, heatmap, and statistics.
 
 import cv2
 import numpy as np
+import queue
+import threading
 import time
+from collections import deque
+import motion_kernel
 from vision import capture_frames, compute_motion_entropy
 from typing import Optional, Tuple
 
 
+# Queued + in-flight overlays in run(): 2 in the display queue, 1 being
+# drawn, 1 on screen
+OVERLAY_RING_SIZE = 4
+
+
 class FishMotionTracker:
     """Real-time fish motion tracker with visual feedback."""
     
@@ -17,8 +26,28 @@ class FishMotionTracker:
         self.camera_index = camera_index
         self.cap: Optional[cv2.VideoCapture] = None
         self.background: Optional[np.ndarray] = None
-        self.motion_history = []
+        self.motion_history = deque(maxlen=100)
         self.frame_count = 0
+        self._reset_background = threading.Event()
+        # Run the per-pixel stage through OpenCV's T-API (UMat) when an
+        # OpenCL device is present; otherwise use preallocated CPU buffers
+        self.use_opencl = cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
+        self._alloc_buffers((480, 640))
+    
+    def _alloc_buffers(self, shape: Tuple[int, int]):
+        """Allocate reusable per-frame scratch buffers for the given (h, w)."""
+        # A background model of another size is useless; re-seed lazily
+        self.background = None
+        self._gray = np.empty(shape, dtype=np.uint8)
+        self._delta = np.empty(shape, dtype=np.uint8)
+        self._thresh = np.empty(shape, dtype=np.uint8)
+        self._mask = np.empty(shape, dtype=np.uint8)
+        self._heatmap = np.empty((*shape, 3), dtype=np.uint8)
+        # Overlays rotate through a ring so the one on screen (or queued for
+        # display) isn't overwritten while the next frame is being drawn
+        self._overlays = [np.empty((*shape, 3), dtype=np.uint8) for _ in range(OVERLAY_RING_SIZE)]
+        self._overlay_idx = 0
         
     def initialize(self) -> bool:
         """Initialize camera."""
@@ -31,14 +60,8 @@ class FishMotionTracker:
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
         self.cap.set(cv2.CAP_PROP_FPS, 30)
         
-        # Initialize background for background subtraction
-        ret, frame = self.cap.read()
-        if ret:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (21, 21), 0)
-            # Convert to float32 for accumulateWeighted
-            self.background = gray.astype(np.float32)
-        
+        # Background is seeded lazily from the first detected frame, using
+        # the same (9,9) blur as the detector
         return True
     
     def detect_motion_regions(self, frame: np.ndarray) -> Tuple[np.ndarray, float, list]:
@@ -47,58 +70,128 @@ class FishMotionTracker:
         
         Returns:
             Tuple of (motion_mask, motion_score, motion_centers)
+            motion_mask is a reused buffer, overwritten on the next call
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        # Use smaller blur kernel for more sensitivity to fine movements
-        gray = cv2.GaussianBlur(gray, (9, 9), 0)  # Reduced from (21,21) for more detail
-        gray_float = gray.astype(np.float32)  # Convert to float32 for accumulateWeighted
+        if self.use_opencl:
+            return self._detect_motion_regions_ocl(frame)
+        if motion_kernel.NUMBA_AVAILABLE:
+            return self._detect_motion_regions_fused(frame)
+        
+        gray = self._blurred_gray(frame)
         
         # Initialize background if not set
         if self.background is None:
-            self.background = gray_float.copy()
+            self.background = gray.copy()
         
-        # Background subtraction (convert background back to uint8 for comparison)
-        background_uint8 = self.background.astype(np.uint8)
-        frame_delta = cv2.absdiff(background_uint8, gray)
+        # Background subtraction
+        frame_delta = cv2.absdiff(self.background, gray, dst=self._delta)
         
         # Much lower threshold (10 instead of 25) to detect smaller movements
-        # Enhance differences for better sensitivity
-        frame_delta_enhanced = cv2.multiply(frame_delta, 1.3)
-        frame_delta_enhanced = np.clip(frame_delta_enhanced, 0, 255).astype(np.uint8)
+        # Enhance differences for better sensitivity (scale + saturate in one pass)
+        frame_delta_enhanced = cv2.convertScaleAbs(frame_delta, dst=frame_delta, alpha=1.3)
         
-        thresh = cv2.threshold(frame_delta_enhanced, 10, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.dilate(thresh, None, iterations=1)  # Reduced from 2 iterations
+        cv2.threshold(frame_delta_enhanced, 10, 255, cv2.THRESH_BINARY, dst=self._thresh)
+        thresh = cv2.dilate(self._thresh, None, dst=self._mask, iterations=1)  # Reduced from 2 iterations
         
         # Update background more slowly (0.3 instead of 0.5) to adapt less quickly
-        # This helps detect slow-moving fish
-        cv2.accumulateWeighted(gray_float, self.background, 0.3)
-        
-        # Find contours (motion regions)
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        motion_centers = []
-        for contour in contours:
-            # Much lower area threshold (30 instead of 100) to detect smaller movements
-            if cv2.contourArea(contour) > 30:  # More sensitive to small fish movements
-                M = cv2.moments(contour)
-                if M["m00"] != 0:
-                    cx = int(M["m10"] / M["m00"])
-                    cy = int(M["m01"] / M["m00"])
-                    motion_centers.append((cx, cy))
+        # This helps detect slow-moving fish. The background is kept as uint8
+        # and blended in place, which avoids float copies of every frame.
+        cv2.addWeighted(self.background, 0.7, gray, 0.3, 0, dst=self.background)
+        
+        motion_centers = self._find_motion_centers(thresh)
         
         # Calculate motion score - use enhanced delta for more sensitivity
         motion_score = np.mean(frame_delta_enhanced)
         
         return thresh, float(motion_score), motion_centers
     
+    def _blurred_gray(self, frame: np.ndarray) -> np.ndarray:
+        """Convert frame to blurred grayscale in the reusable gray buffer."""
+        # Camera may not honour the requested 640x480
+        if frame.shape[:2] != self._gray.shape:
+            self._alloc_buffers(frame.shape[:2])
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        # Use smaller blur kernel for more sensitivity to fine movements
+        cv2.GaussianBlur(gray, (9, 9), 0, dst=gray)  # Reduced from (21,21) for more detail
+        return gray
+    
+    def _detect_motion_regions_fused(self, frame: np.ndarray) -> Tuple[np.ndarray, float, list]:
+        """
+        Same pipeline as detect_motion_regions, with the delta, enhance,
+        threshold and background update fused into one Numba kernel pass.
+        """
+        gray = self._blurred_gray(frame)
+        
+        # Initialize background if not set
+        if self.background is None:
+            self.background = gray.copy()
+        
+        delta_sum = motion_kernel.motion_step(gray, self.background, self._thresh)
+        thresh = cv2.dilate(self._thresh, None, dst=self._mask, iterations=1)
+        
+        motion_centers = self._find_motion_centers(thresh)
+        motion_score = delta_sum / gray.size
+        
+        return thresh, float(motion_score), motion_centers
+    
+    def _detect_motion_regions_ocl(self, frame: np.ndarray) -> Tuple[np.ndarray, float, list]:
+        """
+        Same pipeline as detect_motion_regions, run on UMats so OpenCV can
+        dispatch the per-pixel ops to the OpenCL device. Only the final mask
+        is downloaded, since connected-component labelling runs on the CPU.
+        """
+        gray = cv2.cvtColor(cv2.UMat(frame), cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (9, 9), 0)
+        
+        # Initialize background if not set
+        if self.background is None:
+            self.background = cv2.UMat(gray.get())
+        
+        frame_delta = cv2.absdiff(self.background, gray)
+        frame_delta_enhanced = cv2.convertScaleAbs(frame_delta, alpha=1.3)
+        
+        thresh = cv2.threshold(frame_delta_enhanced, 10, 255, cv2.THRESH_BINARY)[1]
+        thresh = cv2.dilate(thresh, None, iterations=1)
+        
+        self.background = cv2.addWeighted(self.background, 0.7, gray, 0.3, 0)
+        
+        motion_mask = thresh.get()
+        motion_centers = self._find_motion_centers(motion_mask)
+        motion_score = cv2.mean(frame_delta_enhanced)[0]
+        
+        return motion_mask, float(motion_score), motion_centers
+    
+    @staticmethod
+    def _find_motion_centers(thresh: np.ndarray) -> list:
+        """Return (cx, cy) centroids of the motion blobs in a binary mask."""
+        # One pass labels every blob and returns its area and centroid as
+        # arrays, so filtering needs no Python loop
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        
+        # Much lower area threshold (30 instead of 100) to detect smaller movements
+        # Label 0 is the background
+        keep = stats[1:, cv2.CC_STAT_AREA] > 30  # More sensitive to small fish movements
+        return [tuple(c) for c in centroids[1:][keep].astype(np.int32).tolist()]
+    
     def draw_motion_overlay(self, frame: np.ndarray, motion_mask: np.ndarray, 
                            motion_centers: list, motion_score: float) -> np.ndarray:
-        """Draw motion visualization overlay on frame."""
-        overlay = frame.copy()
+        """
+        Draw motion visualization overlay on frame.
+        
+        The returned image is a reused buffer that gets overwritten a few
+        frames later; callers must not retain it across frames.
+        """
+        if frame.shape != self._heatmap.shape:
+            self._alloc_buffers(frame.shape[:2])
         
-        # Create colored heatmap from motion mask
-        heatmap = cv2.applyColorMap(motion_mask, cv2.COLORMAP_HOT)
-        overlay = cv2.addWeighted(overlay, 0.7, heatmap, 0.3, 0)
+        overlay = self._overlays[self._overlay_idx]
+        self._overlay_idx = (self._overlay_idx + 1) % len(self._overlays)
+        
+        # Create colored heatmap from motion mask and blend it straight into
+        # the overlay buffer (no copy of the input frame needed)
+        heatmap = cv2.applyColorMap(motion_mask, cv2.COLORMAP_HOT, dst=self._heatmap)
+        cv2.addWeighted(frame, 0.7, heatmap, 0.3, 0, dst=overlay)
         
         # Draw motion centers (potential fish locations)
         for cx, cy in motion_centers:
@@ -118,10 +211,8 @@ class FishMotionTracker:
         cv2.putText(overlay, f"Frame: {self.frame_count}", (10, 120),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
         
-        # Draw motion history graph
+        # Draw motion history graph (deque drops the oldest entry past 100)
         self.motion_history.append(motion_score)
-        if len(self.motion_history) > 100:
-            self.motion_history.pop(0)
         
         if len(self.motion_history) > 1:
             graph_height = 60
@@ -134,36 +225,64 @@ class FishMotionTracker:
                          (graph_x + graph_width, graph_y + graph_height), (0, 0, 0), -1)
             
             # Normalize motion history for display
-            if max(self.motion_history) > 0:
-                normalized = [int((h / max(self.motion_history)) * graph_height) 
-                             for h in self.motion_history[-graph_width:]]
+            history = np.asarray(self.motion_history, dtype=np.float32)
+            peak = history.max()
+            if peak > 0:
+                normalized = (history[-graph_width:] / peak * graph_height).astype(np.int32)
                 
-                # Draw graph line
-                for i in range(1, len(normalized)):
-                    x1 = graph_x + i - 1
-                    y1 = graph_y + graph_height - normalized[i-1]
-                    x2 = graph_x + i
-                    y2 = graph_y + graph_height - normalized[i]
-                    cv2.line(overlay, (x1, y1), (x2, y2), (0, 255, 0), 1)
+                # Draw graph line as a single polyline
+                xs = np.arange(graph_x, graph_x + len(normalized), dtype=np.int32)
+                ys = graph_y + graph_height - normalized
+                pts = np.stack([xs, ys], axis=1).reshape(-1, 1, 2)
+                cv2.polylines(overlay, [pts], False, (0, 255, 0), 1)
         
         return overlay
     
-    def run(self):
-        """Run the visual debug tool."""
-        if not self.initialize():
-            print(f"Error: Could not open camera {self.camera_index}")
-            return
-        
-        print("Fish Motion Tracker Started")
-        print("Press 'q' to quit, 'r' to reset background, 's' to capture sample")
-        print("-" * 50)
-        
-        last_sample_time = 0
+    @staticmethod
+    def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+        """Put item on a bounded queue, giving up once stop is set."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _capture_loop(self, read_q: queue.Queue, stop: threading.Event):
+        """
+        Capture stage: read frames from the camera into read_q.
         
-        while True:
-            ret, frame = self.cap.read()
+        Frames are decoded into a small ring of reused buffers. The ring holds
+        one more frame than can be queued or in processing at once, so a
+        buffer is never overwritten while the detector is still reading it.
+        """
+        buffers = [None] * (read_q.maxsize + 2)
+        i = 0
+        while not stop.is_set():
+            ret, frame = self.cap.read(buffers[i])
             if not ret:
                 break
+            buffers[i] = frame
+            i = (i + 1) % len(buffers)
+            self._put(read_q, frame, stop)
+        self._put(read_q, None, stop)
+    
+    def _process_loop(self, read_q: queue.Queue, write_q: queue.Queue, stop: threading.Event):
+        """Processing stage: detect motion and draw the overlay for each frame."""
+        while not stop.is_set():
+            try:
+                frame = read_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            
+            if self._reset_background.is_set():
+                self._reset_background.clear()
+                # Re-seeded from this frame by detect_motion_regions
+                self.background = None
+                print("Background reset")
             
             self.frame_count += 1
             
@@ -173,50 +292,93 @@ class FishMotionTracker:
             # Draw overlay
             display_frame = self.draw_motion_overlay(frame, motion_mask, motion_centers, motion_score)
             
-            # Show frame
-            cv2.imshow("Fish Motion Tracker - Press 'q' to quit", display_frame)
-            
-            # Show motion mask separately
-            cv2.imshow("Motion Mask (White = Motion)", motion_mask)
-            
-            # Capture sample every 2 seconds for testing
-            current_time = time.time()
-            if current_time - last_sample_time > 2.0:
-                status = 'LIVE' if motion_score > 1.0 else 'LOW' if motion_score > 0.1 else 'NO MOTION'
-                print(f"Sample {self.frame_count}: Motion Score = {motion_score:.2f}, "
-                      f"Regions = {len(motion_centers)}, Status = {status}")
-                last_sample_time = current_time
-            
-            # Handle keyboard input
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('r'):
-                # Reset background
-                ret, frame = self.cap.read()
-                if ret:
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    gray = cv2.GaussianBlur(gray, (21, 21), 0)
-                    self.background = gray.astype(np.float32)  # Convert to float32
-                    print("Background reset")
-            elif key == ord('s'):
-                # Test entropy capture
-                print("\nTesting entropy capture...")
-                frames = capture_frames(self.camera_index, num_frames=10, delay_ms=100)
-                if frames:
-                    entropy_bytes, motion_score = compute_motion_entropy(frames)
-                    hash_hex = entropy_bytes.hex()
-                    print(f"  Captured {len(frames)} frames")
-                    print(f"  Motion Score: {motion_score:.2f}")
-                    print(f"  Entropy Hash (full): {hash_hex}")
-                    print(f"  Entropy Hash (short): {hash_hex[:32]}...")
-                    print(f"  Hash Length: {len(hash_hex)} chars ({len(entropy_bytes)} bytes)")
-                    status = 'LIVE' if motion_score >= 1.0 else 'LOW' if motion_score >= 0.1 else 'NO MOTION'
-                    print(f"  Status: {status}\n")
-                else:
-                    print("  Failed to capture frames\n")
-        
-        self.cleanup()
+            # motion_mask is reused by the detector, so hand a copy to the display stage
+            self._put(write_q, (display_frame, motion_mask.copy(), motion_score, motion_centers), stop)
+        self._put(write_q, None, stop)
+    
+    def run(self):
+        """
+        Run the visual debug tool.
+        
+        Capture and detection run in background threads connected by bounded
+        queues, so the camera read for frame N+1 overlaps detection of frame N
+        and display of frame N-1. Display and keyboard handling stay on the
+        main thread, as HighGUI requires on some platforms.
+        """
+        if not self.initialize():
+            print(f"Error: Could not open camera {self.camera_index}")
+            return
+        
+        print("Fish Motion Tracker Started")
+        print("Press 'q' to quit, 'r' to reset background, 's' to capture sample")
+        print("-" * 50)
+        
+        last_sample_time = 0
+        
+        read_q: queue.Queue = queue.Queue(maxsize=2)
+        write_q: queue.Queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self._capture_loop, args=(read_q, stop), daemon=True),
+            threading.Thread(target=self._process_loop, args=(read_q, write_q, stop), daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+        
+        try:
+            while True:
+                try:
+                    result = write_q.get(timeout=0.05)
+                except queue.Empty:
+                    result = ()
+                if result is None:
+                    break  # Camera stopped delivering frames
+                
+                if result:
+                    display_frame, motion_mask, motion_score, motion_centers = result
+                    
+                    # Show frame
+                    cv2.imshow("Fish Motion Tracker - Press 'q' to quit", display_frame)
+                    
+                    # Show motion mask separately
+                    cv2.imshow("Motion Mask (White = Motion)", motion_mask)
+                    
+                    # Capture sample every 2 seconds for testing
+                    current_time = time.time()
+                    if current_time - last_sample_time > 2.0:
+                        status = 'LIVE' if motion_score > 1.0 else 'LOW' if motion_score > 0.1 else 'NO MOTION'
+                        print(f"Sample {self.frame_count}: Motion Score = {motion_score:.2f}, "
+                              f"Regions = {len(motion_centers)}, Status = {status}")
+                        last_sample_time = current_time
+                
+                # Handle keyboard input
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    break
+                elif key == ord('r'):
+                    # Reset background on the next processed frame
+                    self._reset_background.set()
+                elif key == ord('s'):
+                    # Test entropy capture
+                    print("\nTesting entropy capture...")
+                    frames = capture_frames(self.camera_index, num_frames=4, delay_ms=100)
+                    if frames:
+                        entropy_bytes, motion_score = compute_motion_entropy(frames)
+                        hash_hex = entropy_bytes.hex()
+                        print(f"  Captured {len(frames)} frames")
+                        print(f"  Motion Score: {motion_score:.2f}")
+                        print(f"  Entropy Hash (full): {hash_hex}")
+                        print(f"  Entropy Hash (short): {hash_hex[:32]}...")
+                        print(f"  Hash Length: {len(hash_hex)} chars ({len(entropy_bytes)} bytes)")
+                        status = 'LIVE' if motion_score >= 1.0 else 'LOW' if motion_score >= 0.1 else 'NO MOTION'
+                        print(f"  Status: {status}\n")
+                    else:
+                        print("  Failed to capture frames\n")
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join(timeout=1.0)
+            self.cleanup()
     
     def cleanup(self):
         """Clean up resources."""
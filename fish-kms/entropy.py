@@ -3,31 +3,110 @@ Entropy generation for Fish KMS.
 Supports camera-based entropy (preferred) and demo fallback mode.
 """
 
+import hashlib
+import itertools
 import os
-from typing import Tuple
-from vision import capture_frames, compute_motion_entropy, check_camera_available
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from vision import capture_frames, compute_motion_entropy, check_camera_available, open_camera
 
+# Domain-separation key for the keyed BLAKE2b that whitens camera entropy
+ENTROPY_DOMAIN_KEY = b"fish-kms/motion-entropy/v1"
 
-def generate_entropy_camera(camera_index: int = 0) -> Tuple[bytes, str, float]:
+# Per-process sample counter mixed into each whitened sample
+_sample_counter = itertools.count()
+
+# Seconds to remember that a camera index was unavailable before probing again
+CAMERA_UNAVAILABLE_TTL = 60.0
+
+# camera_index -> (available, checked_at monotonic time)
+_camera_available_cache: Dict[int, Tuple[bool, float]] = {}
+
+# Camera held open across generate_entropy_camera calls. Callers run on
+# worker threads, so access to the device is serialized with a lock.
+_shared_source: Optional["CameraEntropySource"] = None
+_shared_source_lock = threading.Lock()
+
+
+def _cached_camera_available(camera_index: int) -> bool:
+    """
+    check_camera_available with caching, so repeated calls don't reopen the device.
+    
+    A successful check is remembered for the life of the process (if the
+    camera later disappears, capture fails and we fall back to demo anyway).
+    A failed check is retried after CAMERA_UNAVAILABLE_TTL seconds.
+    Call clear_camera_cache() after plugging cameras in or out to re-probe
+    immediately.
+    """
+    now = time.monotonic()
+    cached = _camera_available_cache.get(camera_index)
+    if cached is not None:
+        available, checked_at = cached
+        if available or now - checked_at < CAMERA_UNAVAILABLE_TTL:
+            return available
+    
+    available = check_camera_available(camera_index)
+    _camera_available_cache[camera_index] = (available, now)
+    return available
+
+
+def clear_camera_cache():
+    """Forget cached camera availability results."""
+    _camera_available_cache.clear()
+
+
+def generate_entropy_camera(camera_index: int = 0, nonce: Optional[bytes] = None) -> Tuple[bytes, str, float]:
     """
     Generate entropy from camera motion detection.
     
     Args:
         camera_index: Camera device index
+        nonce: Optional per-request nonce passed to compute_motion_entropy
         
     Returns:
         Tuple of (entropy_bytes, status, motion_score)
         status: "LIVE" if motion above threshold, "LOW" if below
         motion_score: Average motion detected (0-255 scale)
     """
-    # Capture frames with 100ms delay between frames to ensure motion is captured
-    frames = capture_frames(camera_index, num_frames=10, delay_ms=100)
+    global _shared_source
+    with _shared_source_lock:
+        # Reuse the open camera: skips the device open and warm-up, and
+        # keeps auto-exposure settled between requests
+        source = _shared_source
+        if source is None or source.camera_index != camera_index:
+            if source is not None:
+                source.close()
+            source = _shared_source = CameraEntropySource(camera_index)
+        
+        # Capture frames with 100ms delay between frames to ensure motion is captured
+        frames = source.capture(num_frames=4, delay_ms=100)
+        if frames is None:
+            # Camera failed or went away; reopen it on the next request
+            source.close()
+            _shared_source = None
     
+    return _entropy_from_frames(frames, nonce)
+
+
+def close_shared_camera():
+    """Release the camera held open by generate_entropy_camera."""
+    global _shared_source
+    with _shared_source_lock:
+        if _shared_source is not None:
+            _shared_source.close()
+            _shared_source = None
+
+
+def _entropy_from_frames(frames: Optional[list], nonce: Optional[bytes] = None) -> Tuple[bytes, str, float]:
+    """Turn captured frames into (entropy_bytes, status, motion_score)."""
     if frames is None or len(frames) == 0:
         # Camera unavailable, fallback to demo
         return generate_entropy_demo()
     
-    entropy_bytes, motion_score = compute_motion_entropy(frames)
+    raw_entropy, motion_score = compute_motion_entropy(frames, nonce)
+    entropy_bytes = _whiten(raw_entropy)
     
     # Much more sensitive thresholds for fish movement detection
     # LIVE: any noticeable motion (fish moving)
@@ -45,6 +124,66 @@ def generate_entropy_camera(camera_index: int = 0) -> Tuple[bytes, str, float]:
     return entropy_bytes, status, motion_score
 
 
+def _whiten(raw_entropy: bytes) -> bytes:
+    """
+    Derive the exported 32 entropy bytes with a keyed BLAKE2b PRF.
+    
+    A per-sample nonce (counter + monotonic clock) is mixed in so output is
+    uniform and never repeats, even when there's no motion between samples.
+    """
+    nonce = struct.pack('<QQ', next(_sample_counter), time.monotonic_ns())
+    return hashlib.blake2b(raw_entropy + nonce, key=ENTROPY_DOMAIN_KEY, digest_size=32).digest()
+
+
+class CameraEntropySource:
+    """
+    Camera entropy source that keeps the camera open between samples.
+    
+    Opening a camera is by far the slowest step of a capture, so long-running
+    callers (e.g. the hash monitor) should create one source and call
+    sample() repeatedly. Use as a context manager, or call close(), to
+    release the device.
+    """
+    
+    def __init__(self, camera_index: int = 0):
+        self.camera_index = camera_index
+        self.cap = None
+        self.cap = open_camera(camera_index)
+    
+    def capture(self, num_frames: int = 4, delay_ms: int = 100) -> Optional[list]:
+        """Capture grayscale frames from the held camera, or None on failure."""
+        if self.cap is None:
+            return None
+        return capture_frames(self.camera_index, num_frames=num_frames,
+                              delay_ms=delay_ms, cap=self.cap)
+    
+    def sample(self, num_frames: int = 4, delay_ms: int = 100,
+               nonce: Optional[bytes] = None) -> Tuple[bytes, str, float]:
+        """
+        Capture frames from the held camera and derive entropy from them.
+        
+        Returns:
+            Tuple of (entropy_bytes, status, motion_score), same as
+            generate_entropy_camera
+        """
+        return _entropy_from_frames(self.capture(num_frames, delay_ms), nonce)
+    
+    def close(self):
+        """Release the camera."""
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+    
+    def __enter__(self) -> "CameraEntropySource":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __del__(self):
+        self.close()
+
+
 def generate_entropy_demo() -> Tuple[bytes, str, float]:
     """
     Generate entropy using os.urandom (fallback mode).
@@ -58,23 +197,25 @@ def generate_entropy_demo() -> Tuple[bytes, str, float]:
     return entropy_bytes, "DEMO", 0.0
 
 
-def get_entropy(entropy_mode: str, camera_index: int = 0) -> Tuple[bytes, str, float]:
+def get_entropy(entropy_mode: str, camera_index: int = 0,
+                nonce: Optional[bytes] = None) -> Tuple[bytes, str, float]:
     """
     Get entropy based on configured mode.
     
     Args:
         entropy_mode: "camera" or "demo"
         camera_index: Camera device index (only used in camera mode)
+        nonce: Optional per-request nonce mixed into the motion hash
         
     Returns:
         Tuple of (entropy_bytes, status, motion_score)
     """
     if entropy_mode == "camera":
         try:
-            if not check_camera_available(camera_index):
+            if not _cached_camera_available(camera_index):
                 print(f"Camera {camera_index} not available, falling back to demo mode")
                 return generate_entropy_demo()
-            return generate_entropy_camera(camera_index)
+            return generate_entropy_camera(camera_index, nonce)
         except Exception as e:
             print(f"Camera entropy failed: {e}, falling back to demo mode")
             return generate_entropy_demo()
@@ -4,9 +4,17 @@ Useful for verifying that motion detection is working and generating different h
 """
 
 import cv2
+import sys
 import time
 from vision import capture_frames, compute_motion_entropy
-from entropy import generate_entropy_camera
+from entropy import CameraEntropySource
+
+# Display building blocks, formatted once at import
+RULE = "=" * 70
+THIN_RULE = "-" * 70
+CHANGE_INITIAL = f"Status: {'Initial':20s} | Hash is updating!"
+CHANGE_UPDATED = f"Status: {'✓ CHANGED':20s} | Hash is updating!"
+CHANGE_UNCHANGED = f"Status: {'⚠ UNCHANGED':20s} | Same hash as previous"
 
 
 def monitor_hash_live(camera_index: int = 0, update_interval: float = 1.0):
@@ -17,23 +25,75 @@ def monitor_hash_live(camera_index: int = 0, update_interval: float = 1.0):
         camera_index: Camera device index
         update_interval: Seconds between hash updates
     """
-    print("=" * 70)
-    print("Fish KMS - Live Hash Monitor")
-    print("=" * 70)
-    print(f"Camera: {camera_index}")
-    print(f"Update interval: {update_interval} seconds")
-    print("Press Ctrl+C to stop")
-    print("=" * 70)
-    print()
+    sys.stdout.write(
+        f"{RULE}\n"
+        "Fish KMS - Live Hash Monitor\n"
+        f"{RULE}\n"
+        f"Camera: {camera_index}\n"
+        f"Update interval: {update_interval} seconds\n"
+        "Press Ctrl+C to stop\n"
+        f"{RULE}\n"
+        "\n"
+    )
+    
+    # Screen layout, one entry per terminal row. Rows containing format
+    # fields are refilled on every update; the rest never change.
+    layout = [
+        RULE,
+        "Fish KMS - Live Hash Monitor",
+        RULE,
+        f"Camera: {camera_index} | Status: {{status:4s}} | Motion: {{motion_score:6.2f}}",
+        "Updates: {hash_count} | Elapsed: {elapsed:6.1f}s | Rate: {hashes_per_sec:.2f} hashes/sec",
+        RULE,
+        "",
+        "ENTROPY HASH (Full):",
+        THIN_RULE,
+        "{hash_full}",
+        "",
+        "ENTROPY HASH (Short - First 32 chars):",
+        THIN_RULE,
+        "{hash_short}...",
+        "",
+        "HASH BYTES (First 16 bytes):",
+        THIN_RULE,
+        "Hex:     {first_16_hex}",
+        "Decimal: {first_16_dec}",
+        "",
+        "{change_line}",
+        "",
+        RULE,
+        "Press Ctrl+C to stop",
+        RULE,
+    ]
+    # (cursor-move prefix, row template) for every row that changes
+    dynamic_rows = [
+        (f"\033[{row};1H", line)
+        for row, line in enumerate(layout, start=1) if "{" in line
+    ]
+    
+    # On a terminal, draw the static frame once and then only rewrite the
+    # changing rows in place (ANSI cursor addressing). When piped, just
+    # emit each update as plain text.
+    interactive = sys.stdout.isatty()
+    if interactive:
+        static_screen = "\n".join("" if "{" in line else line for line in layout)
+        sys.stdout.write("\033[2J\033[H" + static_screen + "\n")
+        sys.stdout.flush()
+    end_of_screen = f"\033[{len(layout) + 1};1H"
     
     previous_hash = None
     hash_count = 0
+    elapsed = 0.0
+    hashes_per_sec = 0.0
     start_time = time.time()
     
+    # Open the camera once for the whole session
+    source = CameraEntropySource(camera_index)
+    
     try:
         while True:
             # Generate entropy from camera
-            entropy_bytes, status, motion_score = generate_entropy_camera(camera_index)
+            entropy_bytes, status, motion_score = source.sample()
             
             # Convert to hex for display
             hash_hex = entropy_bytes.hex()
@@ -49,68 +109,67 @@ def monitor_hash_live(camera_index: int = 0, update_interval: float = 1.0):
             elapsed = time.time() - start_time
             hashes_per_sec = hash_count / elapsed if elapsed > 0 else 0
             
-            # Clear screen (works on most terminals)
-            print("\033[2J\033[H", end="")  # ANSI escape codes to clear screen
-            
-            # Display header
-            print("=" * 70)
-            print("Fish KMS - Live Hash Monitor")
-            print("=" * 70)
-            print(f"Camera: {camera_index} | Status: {status:4s} | Motion: {motion_score:6.2f}")
-            print(f"Updates: {hash_count} | Elapsed: {elapsed:6.1f}s | Rate: {hashes_per_sec:.2f} hashes/sec")
-            print("=" * 70)
-            print()
-            
-            # Display hash
-            print("ENTROPY HASH (Full):")
-            print("-" * 70)
-            print(hash_full)
-            print()
-            
-            print("ENTROPY HASH (Short - First 32 chars):")
-            print("-" * 70)
-            print(hash_short + "...")
-            print()
-            
-            # Show hash bytes in different formats
-            print("HASH BYTES (First 16 bytes):")
-            print("-" * 70)
-            first_16 = entropy_bytes[:16]
-            print(f"Hex:     {first_16.hex()}")
-            print(f"Decimal: {', '.join(str(b) for b in first_16)}")
-            print()
-            
             # Show change indicator
             if hash_changed:
-                change_indicator = "✓ CHANGED" if hash_count > 1 else "Initial"
-                print(f"Status: {change_indicator:20s} | Hash is updating!")
+                change_line = CHANGE_UPDATED if hash_count > 1 else CHANGE_INITIAL
             else:
-                print(f"Status: {'⚠ UNCHANGED':20s} | Same hash as previous")
+                change_line = CHANGE_UNCHANGED
             
-            print()
-            print("=" * 70)
-            print("Press Ctrl+C to stop")
-            print("=" * 70)
+            first_16 = entropy_bytes[:16]
+            
+            fields = dict(
+                status=status,
+                motion_score=motion_score,
+                hash_count=hash_count,
+                elapsed=elapsed,
+                hashes_per_sec=hashes_per_sec,
+                hash_full=hash_full,
+                hash_short=hash_short,
+                first_16_hex=first_16.hex(),
+                first_16_dec=", ".join(map(str, first_16)),
+                change_line=change_line,
+            )
+            
+            # Single write per update
+            if interactive:
+                # Move to each changing row, rewrite it, clear to end of line
+                screen = "".join(
+                    move + line.format(**fields) + "\033[K"
+                    for move, line in dynamic_rows
+                ) + end_of_screen
+            else:
+                screen = "\n".join(line.format(**fields) for line in layout) + "\n\n"
+            sys.stdout.write(screen)
+            sys.stdout.flush()
             
             # Wait before next update
             time.sleep(update_interval)
             
     except KeyboardInterrupt:
-        print("\n\n" + "=" * 70)
-        print("Monitoring stopped")
-        print(f"Total hashes generated: {hash_count}")
-        print(f"Total time: {elapsed:.1f} seconds")
-        print(f"Average rate: {hashes_per_sec:.2f} hashes/second")
-        print("=" * 70)
+        sys.stdout.write(
+            f"\n\n{RULE}\n"
+            "Monitoring stopped\n"
+            f"Total hashes generated: {hash_count}\n"
+            f"Total time: {elapsed:.1f} seconds\n"
+            f"Average rate: {hashes_per_sec:.2f} hashes/second\n"
+            f"{RULE}\n"
+        )
+        sys.stdout.flush()
+    finally:
+        source.close()
 
 
-def compare_hashes(camera_index: int = 0, num_samples: int = 10):
+def compare_hashes(camera_index: int = 0, num_samples: int = 10, inter_sample_delay: float = 0.0):
     """
     Capture multiple hash samples and compare them to verify uniqueness.
     
     Args:
         camera_index: Camera device index
         num_samples: Number of hash samples to capture
+        inter_sample_delay: Extra seconds to wait between samples. Defaults
+            to 0: each sample spans ~0.5s (4 frames ~150ms apart), samples
+            run back to back, and stale frames are drained before each
+            capture, so no two samples share a frame.
     """
     print("=" * 70)
     print("Fish KMS - Hash Comparison Test")
@@ -123,17 +182,19 @@ def compare_hashes(camera_index: int = 0, num_samples: int = 10):
     hashes = []
     motion_scores = []
     
-    for i in range(num_samples):
-        print(f"Capturing sample {i+1}/{num_samples}...", end=" ", flush=True)
-        
-        entropy_bytes, status, motion_score = generate_entropy_camera(camera_index)
-        hash_hex = entropy_bytes.hex()
-        
-        hashes.append(hash_hex)
-        motion_scores.append(motion_score)
-        
-        print(f"✓ Motion: {motion_score:.2f}, Status: {status}")
-        time.sleep(0.5)  # Small delay between samples
+    with CameraEntropySource(camera_index) as source:
+        for i in range(num_samples):
+            print(f"Capturing sample {i+1}/{num_samples}...", end=" ", flush=True)
+            
+            entropy_bytes, status, motion_score = source.sample()
+            hash_hex = entropy_bytes.hex()
+            
+            hashes.append(hash_hex)
+            motion_scores.append(motion_score)
+            
+            print(f"✓ Motion: {motion_score:.2f}, Status: {status}")
+            if inter_sample_delay > 0:
+                time.sleep(inter_sample_delay)
     
     print()
     print("=" * 70)
@@ -3,49 +3,76 @@ Utility script to list all available cameras and test them.
 """
 
 import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _probe_camera(index: int) -> dict:
+    """
+    Open a camera index and try to read a frame from it.
+    
+    Returns:
+        Dict with 'index' and 'status' ("ok", "no_frames" or "unavailable"),
+        plus 'width', 'height' and 'fps' when status is "ok"
+    """
+    cap = cv2.VideoCapture(index)
+    result = {'index': index, 'status': 'unavailable'}
+    if cap.isOpened():
+        # Try to read a frame to confirm it works
+        ret, frame = cap.read()
+        if ret:
+            # Get camera properties
+            result.update(
+                status='ok',
+                width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                fps=cap.get(cv2.CAP_PROP_FPS),
+            )
+        else:
+            result['status'] = 'no_frames'
+        cap.release()
+    return result
 
 
 def list_available_cameras(max_test: int = 5):
     """
     List all available cameras by testing indices 0 to max_test.
     
+    Indices are probed in parallel (VideoCapture releases the GIL while the
+    backend negotiates with the device), so a scan takes about as long as
+    the slowest probe rather than the sum of all of them.
+    
     Args:
         max_test: Maximum camera index to test (default: 5)
     """
     print("Scanning for available cameras...")
     print("-" * 50)
     
+    with ThreadPoolExecutor(max_workers=max_test) as executor:
+        results = list(executor.map(_probe_camera, range(max_test)))
+    
     available_cameras = []
     
-    for i in range(max_test):
-        cap = cv2.VideoCapture(i)
-        if cap.isOpened():
-            # Try to read a frame to confirm it works
-            ret, frame = cap.read()
-            if ret:
-                # Get camera properties
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                
-                available_cameras.append({
-                    'index': i,
-                    'width': width,
-                    'height': height,
-                    'fps': fps
-                })
-                
-                print(f"✓ Camera {i}: Available")
-                print(f"  Resolution: {width}x{height}")
-                print(f"  FPS: {fps}")
-                print()
-            else:
-                print(f"✗ Camera {i}: Opens but cannot read frames")
+    # executor.map keeps index order, so output matches a serial scan
+    for result in results:
+        i = result['index']
+        if result['status'] == 'ok':
+            width, height, fps = result['width'], result['height'], result['fps']
+            
+            available_cameras.append({
+                'index': i,
+                'width': width,
+                'height': height,
+                'fps': fps
+            })
+            
+            print(f"✓ Camera {i}: Available")
+            print(f"  Resolution: {width}x{height}")
+            print(f"  FPS: {fps}")
+            print()
+        elif result['status'] == 'no_frames':
+            print(f"✗ Camera {i}: Opens but cannot read frames")
         else:
             print(f"✗ Camera {i}: Not available")
-        
-        if cap.isOpened():
-            cap.release()
     
     print("-" * 50)
     if available_cameras:
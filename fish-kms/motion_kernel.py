@@ -0,0 +1,52 @@
+"""
+Fused motion detection kernel for the debug tracker.
+Compiled with Numba when it is installed (optional dependency).
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    # Serial on purpose: the tracker calls this from its detection thread,
+    # and starting a Numba parallel region off the main thread can hang
+    # interpreter exit (TBB threading layer). That stage already has its own
+    # thread, so parallelism here buys little.
+    @njit(fastmath=True, cache=True)
+    def motion_step(gray: np.ndarray, background: np.ndarray, thresh_out: np.ndarray) -> int:
+        """
+        Background subtraction, enhancement, threshold and background update
+        in a single pass over the frame.
+
+        Per pixel this computes |background - gray|, scales it by 1.3 with
+        saturation, thresholds it at 10 into thresh_out (0/255), and blends
+        gray into the uint8 background with weight 0.3, matching
+        addWeighted(background, 0.7, gray, 0.3, 0).
+
+        Args:
+            gray: Blurred grayscale frame (uint8)
+            background: Running background model (uint8), updated in place
+            thresh_out: Output binary mask (uint8), same shape as gray
+
+        Returns:
+            Sum of the enhanced deltas (divide by pixel count for the mean)
+        """
+        height, width = gray.shape
+        total = 0
+        for i in range(height):
+            row_total = 0
+            for j in range(width):
+                g = gray[i, j]
+                b = background[i, j]
+                delta = abs(np.int32(b) - np.int32(g))
+                enhanced = min(255, np.int32(delta * 1.3 + 0.5))
+                thresh_out[i, j] = 255 if enhanced > 10 else 0
+                row_total += enhanced
+                background[i, j] = np.uint8(b * 0.7 + g * 0.3 + 0.5)
+            total += row_total
+        return total
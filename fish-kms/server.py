@@ -3,15 +3,18 @@ Fish KMS Server - Centralized encryption authority.
 Provides encryption/decryption services with fish tank entropy gating.
 """
 
+import asyncio
+import logging
 import os
-from datetime import datetime
-from typing import Optional
-from fastapi import FastAPI, Header, HTTPException
+import time
+from typing import Dict, Optional, Tuple
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from crypto import encrypt_aes_gcm, decrypt_aes_gcm
-from entropy import get_entropy
+from crypto import encrypt_many, encrypt_aes_gcm_raw, decrypt_aes_gcm, check_aes_acceleration
+from entropy import get_entropy, close_shared_camera
 from state import get_state
 
 # Load environment variables
@@ -23,13 +26,30 @@ FISH_KMS_PORT = int(os.getenv("FISH_KMS_PORT", "8000"))
 UNLOCK_WINDOW_SECONDS = int(os.getenv("UNLOCK_WINDOW_SECONDS", "600"))
 ENTROPY_MODE = os.getenv("ENTROPY_MODE", "camera")
 CAMERA_INDEX = int(os.getenv("CAMERA_INDEX", "0"))
+ENTROPY_REFRESH_SECONDS = int(os.getenv("ENTROPY_REFRESH_SECONDS", "30"))
+ENCRYPT_MAX_BATCH = int(os.getenv("ENCRYPT_MAX_BATCH", "64"))
+ENCRYPT_MAX_WAIT_MS = float(os.getenv("ENCRYPT_MAX_WAIT_MS", "2"))
+# Seconds an owner's encrypt batcher may sit idle before it shuts down
+ENCRYPT_WORKER_IDLE_SECONDS = 60.0
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
-# Initialize FastAPI app
-app = FastAPI(title="Fish KMS Server", version="1.0.0")
+# Logging (encrypt/decrypt messages are DEBUG; set LOG_LEVEL=DEBUG to see them)
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s:     %(name)s - %(message)s")
+logger = logging.getLogger("fish_kms")
+
+# Initialize FastAPI app (orjson serializes responses much faster than stdlib json)
+app = FastAPI(title="Fish KMS Server", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Initialize state
 state = get_state()
 
+# The camera is a single device: allow one capture in flight at a time.
+# Other callers wait here on the event loop instead of parking a worker thread.
+camera_semaphore = asyncio.Semaphore(1)
+
+# ownerId -> (queue of (plaintext, future), batch worker task)
+encrypt_batchers: Dict[str, Tuple[asyncio.Queue, asyncio.Task]] = {}
+
 
 # Request/Response Models
 class UnlockRequest(BaseModel):
@@ -47,21 +67,12 @@ class EncryptRequest(BaseModel):
     plaintext: str
 
 
-class EncryptResponse(BaseModel):
-    ciphertext: str
-    nonce: str
-
-
 class DecryptRequest(BaseModel):
     ownerId: str
     ciphertext: str
     nonce: str
 
 
-class DecryptResponse(BaseModel):
-    plaintext: str
-
-
 class HealthResponse(BaseModel):
     ok: bool
     mode: str
@@ -74,6 +85,149 @@ class StatusResponse(BaseModel):
     totalOwners: int
 
 
+async def get_owner_aead(owner_id: str):
+    """
+    Get the owner's cached cipher.
+    
+    The first request for an owner generates and persists a master key;
+    that runs in a worker thread so disk I/O never blocks the event loop.
+    """
+    aead = state.aead.get(owner_id)
+    if aead is None:
+        aead = await asyncio.to_thread(state.get_aead, owner_id)
+    return aead
+
+
+async def encrypt_batched(owner_id: str, plaintext: bytes) -> Tuple[str, str]:
+    """
+    Encrypt plaintext through the owner's batch worker.
+    
+    Concurrent requests for the same owner are coalesced and encrypted
+    together with encrypt_many, one shared cipher lookup and nonce draw.
+    The plaintext must already be encoded, so one bad request can't fail
+    the rest of its batch.
+    
+    Returns:
+        Tuple of (ciphertext_b64, nonce_b64)
+    """
+    batcher = encrypt_batchers.get(owner_id)
+    if batcher is None:
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(encrypt_worker(owner_id, queue))
+        batcher = encrypt_batchers[owner_id] = (queue, task)
+    
+    future = asyncio.get_running_loop().create_future()
+    batcher[0].put_nowait((plaintext, future))
+    return await future
+
+
+async def encrypt_worker(owner_id: str, queue: asyncio.Queue):
+    """
+    Drain an owner's encrypt queue in batches.
+    
+    Each batch takes up to ENCRYPT_MAX_BATCH requests that are already
+    queued. Only while under load (the previous batch had more than one
+    request) does it wait up to ENCRYPT_MAX_WAIT_MS for more to arrive, so
+    a lone request is dispatched immediately. The worker exits after
+    ENCRYPT_WORKER_IDLE_SECONDS without requests.
+    """
+    loop = asyncio.get_running_loop()
+    max_wait = ENCRYPT_MAX_WAIT_MS / 1000.0
+    last_batch_size = 0
+    
+    while True:
+        try:
+            batch = [await asyncio.wait_for(queue.get(), ENCRYPT_WORKER_IDLE_SECONDS)]
+        except asyncio.TimeoutError:
+            if queue.empty():
+                del encrypt_batchers[owner_id]
+                return
+            continue
+        
+        # Take whatever is already queued; wait briefly for stragglers only
+        # if the last batch shows requests are arriving concurrently
+        deadline = loop.time() + (max_wait if last_batch_size > 1 else 0.0)
+        while len(batch) < ENCRYPT_MAX_BATCH:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        last_batch_size = len(batch)
+        
+        try:
+            aead = await get_owner_aead(owner_id)
+            results = encrypt_many(aead, [plaintext for plaintext, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():  # Request may have been cancelled
+                future.set_result(result)
+
+
+async def sample_entropy():
+    """
+    Run get_entropy in a worker thread without blocking the event loop.
+    
+    Returns:
+        Tuple of (entropy_bytes, status, motion_score)
+    """
+    async with camera_semaphore:
+        return await asyncio.to_thread(
+            get_entropy, ENTROPY_MODE, CAMERA_INDEX, state.next_nonce_bytes()
+        )
+
+
+async def refresh_entropy_status():
+    """
+    Sample entropy in the background so /health can answer from memory.
+    
+    This is the only periodic camera user; it runs every
+    ENTROPY_REFRESH_SECONDS in a worker thread.
+    """
+    while True:
+        try:
+            state.set_entropy_result(*await sample_entropy())
+        except Exception as e:
+            logger.warning("Entropy refresh failed: %s", e)
+        await asyncio.sleep(ENTROPY_REFRESH_SECONDS)
+
+
+@app.on_event("startup")
+async def start_entropy_refresh():
+    """Start the background entropy sampler."""
+    # Keep a reference so the task isn't garbage collected
+    app.state.entropy_task = asyncio.create_task(refresh_entropy_status())
+
+
+@app.on_event("shutdown")
+async def stop_entropy_refresh():
+    """Stop the background entropy sampler and the encrypt batch workers."""
+    task = getattr(app.state, "entropy_task", None)
+    if task is not None:
+        task.cancel()
+    for _, worker in encrypt_batchers.values():
+        worker.cancel()
+    encrypt_batchers.clear()
+
+
+@app.on_event("shutdown")
+async def release_camera():
+    """Release the camera kept open between entropy captures."""
+    # Waits for any capture still running on a worker thread
+    await asyncio.to_thread(close_shared_camera)
+
+
 # Auth middleware helper
 def verify_api_key(x_fish_auth: Optional[str] = Header(None)) -> None:
     """Verify X-FISH-AUTH header matches API key."""
@@ -84,8 +238,17 @@ def verify_api_key(x_fish_auth: Optional[str] = Header(None)) -> None:
 # Endpoints
 @app.get("/health", response_model=HealthResponse)
 async def health():
-    """Health check endpoint showing server status and entropy mode."""
-    entropy_bytes, entropy_status, motion_score = get_entropy(ENTROPY_MODE, CAMERA_INDEX)
+    """
+    Health check endpoint showing server status and entropy mode.
+    
+    Reports the last background entropy sample rather than capturing, so
+    probes are cheap and never compete with /unlock for the camera.
+    """
+    cached = state.get_cached_entropy_status()
+    if cached is None:
+        entropy_status, motion_score = "PENDING", 0.0
+    else:
+        entropy_status, motion_score, _ = cached
     
     return HealthResponse(
         ok=True,
@@ -109,14 +272,21 @@ async def unlock(
     owner_id = request.ownerId
     
     # Perform entropy check (liveness gate)
-    entropy_bytes, entropy_status, motion_score = get_entropy(ENTROPY_MODE, CAMERA_INDEX)
-    print(f"Unlock request for {owner_id}: entropy_status={entropy_status}, motion={motion_score:.2f}")
+    # Capture runs in a worker thread so the event loop keeps serving requests
+    entropy_bytes, entropy_status, motion_score = await sample_entropy()
+    state.set_entropy_result(entropy_bytes, entropy_status, motion_score)
+    logger.info("Unlock request for %s: entropy_status=%s, motion=%.2f",
+                owner_id, entropy_status, motion_score)
     
     # Unlock owner for configured window
     unlocked_until_epoch = state.unlock(owner_id, UNLOCK_WINDOW_SECONDS)
-    unlocked_until_iso = datetime.fromtimestamp(unlocked_until_epoch).isoformat()
+    # UTC ISO 8601 straight from the epoch (no datetime object or tz lookup)
+    unlocked_until_iso = "%s.%06dZ" % (
+        time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(unlocked_until_epoch)),
+        int(unlocked_until_epoch % 1 * 1e6),
+    )
     
-    print(f"Unlock OK: {owner_id} unlocked until {unlocked_until_iso}")
+    logger.info("Unlock OK: %s unlocked until %s", owner_id, unlocked_until_iso)
     
     return UnlockResponse(
         ok=True,
@@ -124,7 +294,7 @@ async def unlock(
     )
 
 
-@app.post("/encrypt", response_model=EncryptResponse)
+@app.post("/encrypt")
 async def encrypt(
     request: EncryptRequest,
     x_fish_auth: Optional[str] = Header(None, alias="X-FISH-AUTH")
@@ -142,21 +312,46 @@ async def encrypt(
     # For now, we'll allow encrypt even if not unlocked (as per requirements)
     # But decrypt will require unlock
     
-    # Get or create master key for owner
-    master_key = state.get_or_create_master_key(owner_id)
+    # Encode here so invalid text (e.g. lone surrogates) fails only this request
+    try:
+        plaintext_bytes = plaintext.encode('utf-8')
+    except UnicodeEncodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid plaintext: {str(e)}")
     
-    # Encrypt
-    ciphertext_b64, nonce_b64 = encrypt_aes_gcm(master_key, plaintext)
+    # Encrypt (batched with concurrent requests for the same owner)
+    ciphertext_b64, nonce_b64 = await encrypt_batched(owner_id, plaintext_bytes)
     
-    print(f"Encrypt OK: {owner_id} encrypted {len(plaintext)} bytes")
+    logger.debug("Encrypt OK: %s encrypted %d bytes", owner_id, len(plaintext))
     
-    return EncryptResponse(
-        ciphertext=ciphertext_b64,
-        nonce=nonce_b64
-    )
+    # Plain dict: no response model to build and revalidate on this hot path
+    return {"ciphertext": ciphertext_b64, "nonce": nonce_b64}
+
+
+@app.post("/encrypt_raw")
+async def encrypt_raw(
+    ownerId: str,
+    request: Request,
+    x_fish_auth: Optional[str] = Header(None, alias="X-FISH-AUTH")
+):
+    """
+    Encrypt the raw request body for owner (binary variant of /encrypt).
+    
+    Returns nonce || ciphertext as application/octet-stream: the first 12
+    bytes are the GCM nonce, the rest is the ciphertext with its tag.
+    No base64 or JSON on either side.
+    """
+    verify_api_key(x_fish_auth)
+    
+    plaintext = await request.body()
+    aead = await get_owner_aead(ownerId)
+    ciphertext, nonce = encrypt_aes_gcm_raw(aead, plaintext)
+    
+    logger.debug("Encrypt OK: %s encrypted %d raw bytes", ownerId, len(plaintext))
+    
+    return Response(content=nonce + ciphertext, media_type="application/octet-stream")
 
 
-@app.post("/decrypt", response_model=DecryptResponse)
+@app.post("/decrypt")
 async def decrypt(
     request: DecryptRequest,
     x_fish_auth: Optional[str] = Header(None, alias="X-FISH-AUTH")
@@ -171,22 +366,25 @@ async def decrypt(
     ciphertext_b64 = request.ciphertext
     nonce_b64 = request.nonce
     
-    # Check if unlocked
-    if not state.is_unlocked(owner_id):
+    # Check if unlocked and get the owner's cipher in one lookup
+    try:
+        aead = state.check_and_decrypt_ready(owner_id)
+    except KeyError:
         raise HTTPException(
             status_code=403,
             detail="Vault is locked. Please unlock first."
         )
     
-    # Get master key (must exist if we have secrets)
-    master_key = state.get_or_create_master_key(owner_id)
+    if aead is None:
+        # Cipher not built yet (master key must exist if we have secrets)
+        aead = await get_owner_aead(owner_id)
     
     # Decrypt
     try:
-        plaintext = decrypt_aes_gcm(master_key, ciphertext_b64, nonce_b64)
-        print(f"Decrypt OK: {owner_id} decrypted {len(plaintext)} bytes")
+        plaintext = decrypt_aes_gcm(aead, ciphertext_b64, nonce_b64)
+        logger.debug("Decrypt OK: %s decrypted %d bytes", owner_id, len(plaintext))
         
-        return DecryptResponse(plaintext=plaintext)
+        return {"plaintext": plaintext}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Decryption failed: {str(e)}")
 
@@ -212,5 +410,6 @@ if __name__ == "__main__":
     print(f"Starting Fish KMS Server on port {FISH_KMS_PORT}")
     print(f"Entropy mode: {ENTROPY_MODE}")
     print(f"Unlock window: {UNLOCK_WINDOW_SECONDS} seconds")
+    check_aes_acceleration()
     uvicorn.run(app, host="0.0.0.0", port=FISH_KMS_PORT)
 
@@ -1,15 +1,23 @@
 """
 State management for Fish KMS.
 Manages master keys and unlock store in memory.
-Optionally persists to disk for hackathon demo.
+Optionally persists master keys to SQLite for hackathon demo.
 """
 
+import heapq
+import itertools
 import json
+import logging
 import os
+import sqlite3
+import threading
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from crypto import generate_master_key
 
+logger = logging.getLogger("fish_kms")
+
 
 class KMSState:
     """Manages KMS state: master keys and unlock store."""
@@ -19,16 +27,37 @@ class KMSState:
         Initialize state manager.
         
         Args:
-            state_file: Optional path to JSON file for persistence
+            state_file: Optional path to SQLite database for persistence
         """
         self.master_keys: Dict[str, bytes] = {}  # ownerId -> key bytes
+        self.aead: Dict[str, AESGCM] = {}  # ownerId -> cipher built from master key
         self.unlock_store: Dict[str, float] = {}  # ownerId -> unlocked_until_epoch
+        self._expiry_heap: List[Tuple[float, str]] = []  # (unlocked_until_epoch, ownerId)
         self.state_file = state_file
+        # Latest entropy sample: (entropy_bytes, status, motion_score, monotonic ts)
+        self._last_entropy_result: Optional[Tuple[bytes, str, float, float]] = None
+        # Source of unique per-request nonces for the motion hash
+        self._nonce_counter = itertools.count()
+        # Serializes key creation, which may run on worker threads
+        self._create_lock = threading.Lock()
+        
+        self.db: Optional[sqlite3.Connection] = None
         
-        # Load from disk if file exists
-        if state_file and os.path.exists(state_file):
+        # Open the database (creating it if needed) and load existing keys
+        if state_file:
+            self._open_db()
             self.load_from_disk()
     
+    def _open_db(self):
+        """Open the key database in WAL mode and create the schema."""
+        # Autocommit; keys are written from worker threads, serialized by
+        # _create_lock, so the connection may be shared across threads
+        self.db = sqlite3.connect(self.state_file, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS keys (owner TEXT PRIMARY KEY, key BLOB)")
+    
     def get_or_create_master_key(self, owner_id: str) -> bytes:
         """
         Get existing master key or create a new one for owner.
@@ -39,11 +68,45 @@ class KMSState:
         Returns:
             32-byte master key
         """
-        if owner_id not in self.master_keys:
-            self.master_keys[owner_id] = generate_master_key()
-            self.save_to_disk()
-            print(f"Generated new master key for owner {owner_id}")
-        return self.master_keys[owner_id]
+        try:
+            return self.master_keys[owner_id]
+        except KeyError:
+            pass
+        
+        # Slow path: first use by this owner. Re-check under the lock so two
+        # concurrent first requests can't mint different keys.
+        with self._create_lock:
+            key = self.master_keys.get(owner_id)
+            if key is None:
+                key = generate_master_key()
+                # Persist first: if the write fails, the key is never cached
+                # or handed out and the request fails instead
+                self.save_to_disk(owner_id, key)
+                self.master_keys[owner_id] = key
+                logger.info("Generated new master key for owner %s", owner_id)
+        return key
+    
+    def get_aead(self, owner_id: str) -> AESGCM:
+        """
+        Get the AES-GCM cipher for owner, creating key and cipher on first use.
+        
+        The cipher is built once per owner, so the AES key schedule doesn't
+        run again on every encrypt/decrypt request.
+        
+        Args:
+            owner_id: Owner UUID string
+            
+        Returns:
+            AESGCM instance for the owner's master key
+        """
+        try:
+            return self.aead[owner_id]
+        except KeyError:
+            pass
+        
+        aead = AESGCM(self.get_or_create_master_key(owner_id))
+        self.aead[owner_id] = aead
+        return aead
     
     def is_unlocked(self, owner_id: str) -> bool:
         """
@@ -55,12 +118,33 @@ class KMSState:
         Returns:
             True if unlocked and within time window
         """
-        if owner_id not in self.unlock_store:
+        self._expire_now()
+        unlocked_until = self.unlock_store.get(owner_id)
+        if unlocked_until is None:
             return False
         
-        unlocked_until = self.unlock_store[owner_id]
         return time.time() < unlocked_until
     
+    def check_and_decrypt_ready(self, owner_id: str) -> Optional[AESGCM]:
+        """
+        Check the unlock window and get the owner's cipher in one step.
+        
+        Args:
+            owner_id: Owner UUID string
+            
+        Returns:
+            Cached AESGCM for the owner, or None if it hasn't been built yet
+            (see get_aead)
+            
+        Raises:
+            KeyError: If the owner is not unlocked or the window has expired
+        """
+        self._expire_now()
+        unlocked_until = self.unlock_store.get(owner_id)
+        if unlocked_until is None or time.time() >= unlocked_until:
+            raise KeyError(owner_id)
+        return self.aead.get(owner_id)
+    
     def unlock(self, owner_id: str, unlock_window_seconds: int) -> float:
         """
         Unlock owner for specified time window.
@@ -72,9 +156,18 @@ class KMSState:
         Returns:
             Unix timestamp when unlock expires
         """
+        self._expire_now()
         unlocked_until = time.time() + unlock_window_seconds
         self.unlock_store[owner_id] = unlocked_until
-        print(f"Unlocked owner {owner_id} until {unlocked_until}")
+        heapq.heappush(self._expiry_heap, (unlocked_until, owner_id))
+        
+        # Re-unlocking an owner leaves its older entry in the heap until that
+        # window ends; rebuild once stale entries outnumber live ones, so
+        # the heap stays O(owners) however often owners re-unlock
+        if len(self._expiry_heap) > 2 * len(self.unlock_store) + 16:
+            self._expiry_heap = [(until, oid) for oid, until in self.unlock_store.items()]
+            heapq.heapify(self._expiry_heap)
+        logger.debug("Unlocked owner %s until %s", owner_id, unlocked_until)
         return unlocked_until
     
     def get_unlocked_until(self, owner_id: str) -> Optional[float]:
@@ -83,51 +176,124 @@ class KMSState:
     
     def get_unlocked_count(self) -> int:
         """Get count of currently unlocked owners."""
+        self._expire_now()
+        return len(self.unlock_store)
+    
+    def _expire_now(self):
+        """
+        Drop unlock entries whose window has passed.
+        
+        Expiries are kept in a min-heap, so this only touches entries that
+        actually expired. An owner re-unlocked since an entry was pushed
+        keeps the newer window; the stale heap entry is just discarded.
+        """
+        heap = self._expiry_heap
         now = time.time()
-        return sum(1 for until in self.unlock_store.values() if until > now)
+        while heap and heap[0][0] <= now:
+            unlocked_until, owner_id = heapq.heappop(heap)
+            if self.unlock_store.get(owner_id) == unlocked_until:
+                del self.unlock_store[owner_id]
+    
+    def next_nonce_bytes(self) -> bytes:
+        """
+        Get a unique 8-byte nonce for mixing into an entropy sample.
+        
+        A counter is enough here: the nonce only has to make each sample's
+        hash input distinct, the frames themselves carry the entropy.
+        """
+        return next(self._nonce_counter).to_bytes(8, 'little')
+    
+    def set_entropy_result(self, entropy_bytes: bytes, status: str, motion_score: float):
+        """Record the latest entropy sample for cheap status reads."""
+        self._last_entropy_result = (entropy_bytes, status, motion_score, time.monotonic())
     
-    def save_to_disk(self):
-        """Save master keys to disk (plaintext for hackathon demo)."""
-        if not self.state_file:
+    def get_cached_entropy_status(self) -> Optional[Tuple[str, float, float]]:
+        """
+        Get the most recent entropy status without touching the camera.
+        
+        Returns:
+            Tuple of (status, motion_score, age_seconds), or None if no
+            sample has been taken yet
+        """
+        result = self._last_entropy_result
+        if result is None:
+            return None
+        _, status, motion_score, sampled_at = result
+        return status, motion_score, time.monotonic() - sampled_at
+    
+    def save_to_disk(self, owner_id: str, key: bytes):
+        """
+        Persist one owner's master key.
+        
+        Keys live in a SQLite table (plaintext for hackathon demo), so saving
+        a key is a single B-tree insert regardless of how many owners exist.
+        Unlock state is not persisted.
+        
+        Raises:
+            sqlite3.Error: If the key could not be written. The key must not
+                be used then, or data encrypted under it is lost on restart.
+        """
+        if self.db is None:
             return
         
         try:
-            # Convert bytes to base64 for JSON serialization
-            keys_dict = {
-                owner_id: key.hex()  # Store as hex string
-                for owner_id, key in self.master_keys.items()
-            }
-            
-            data = {
-                "master_keys": keys_dict,
-                "unlock_store": self.unlock_store
-            }
-            
-            with open(self.state_file, 'w') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            print(f"Failed to save state to disk: {e}")
+            self.db.execute("INSERT OR REPLACE INTO keys VALUES (?, ?)", (owner_id, key))
+        except sqlite3.Error as e:
+            logger.error("Failed to save state to disk: %s", e)
+            raise
     
     def load_from_disk(self):
-        """Load master keys from disk."""
-        if not self.state_file or not os.path.exists(self.state_file):
+        """Load all master keys from the database."""
+        if self.db is None:
             return
         
         try:
-            with open(self.state_file, 'r') as f:
-                data = json.load(f)
+            rows = self.db.execute("SELECT owner, key FROM keys").fetchall()
+            for owner_id, key in rows:
+                self.master_keys[owner_id] = bytes(key)
+            logger.info("Loaded state from %s", self.state_file)
+        except sqlite3.Error as e:
+            logger.error("Failed to load state from disk: %s", e)
+    
+    def import_legacy_file(self, path: str):
+        """
+        Import keys from an older JSON state file, then rename it.
+        
+        Handles both the single-document {"master_keys": {...}} format and
+        the JSON-lines key log. Keys already in the database win.
+        """
+        if self.db is None or not os.path.exists(path):
+            return
+        
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+            
+            keys: Dict[str, bytes] = {}
+            try:
+                legacy = json.loads(text)
+            except json.JSONDecodeError:
+                legacy = None
             
-            # Convert hex strings back to bytes
-            keys_dict = data.get("master_keys", {})
-            self.master_keys = {
-                owner_id: bytes.fromhex(key_hex)
-                for owner_id, key_hex in keys_dict.items()
-            }
+            if isinstance(legacy, dict) and "master_keys" in legacy:
+                for owner_id, key_hex in legacy["master_keys"].items():
+                    keys[owner_id] = bytes.fromhex(key_hex)
+            else:
+                for line in text.splitlines():
+                    try:
+                        record = json.loads(line)
+                        keys[record["owner"]] = bytes.fromhex(record["key"])
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Blank or torn line (e.g. crash mid-append)
             
-            self.unlock_store = data.get("unlock_store", {})
-            print(f"Loaded state from {self.state_file}")
+            with self._create_lock:
+                self.db.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?)", keys.items())
+                for owner_id, key in keys.items():
+                    self.master_keys.setdefault(owner_id, key)
+            os.replace(path, path + ".migrated")
+            logger.info("Imported %d keys from %s", len(keys), path)
         except Exception as e:
-            print(f"Failed to load state from disk: {e}")
+            logger.error("Failed to import legacy state: %s", e)
 
 
 # Global state instance
@@ -138,6 +304,7 @@ def get_state() -> KMSState:
     """Get global state instance."""
     global _state
     if _state is None:
-        _state = KMSState(state_file="state.json")
+        _state = KMSState(state_file="state.db")
+        _state.import_legacy_file("state.json")
     return _state
 
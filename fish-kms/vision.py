@@ -5,116 +5,235 @@ Computer vision utilities for fish tank motion detection.
 import cv2
 import numpy as np
 import hashlib
+import math
 import os
 import struct
 import time
 from typing import Optional, Tuple
 
+# Capture resolution. Motion detection doesn't need more: a fish still spans
+# many pixels, and each frame is a quarter of the bytes of 640x480.
+CAPTURE_WIDTH = 320
+CAPTURE_HEIGHT = 240
 
-def capture_frames(camera_index: int = 0, num_frames: int = 10, delay_ms: int = 100) -> Optional[list[np.ndarray]]:
+# Weight of the mean frame difference in the motion score. Unblurred frames
+# carry more sensor noise, so the mean is scaled down to keep static-scene
+# scores in line with the old blurred 640x480 pipeline.
+MOTION_MEAN_WEIGHT = 0.75
+
+# Motion score above which compute_motion_entropy stops processing further
+# frame pairs. Matches the LIVE threshold in entropy.py: the score is never
+# below MOTION_MEAN_WEIGHT * mean, so stopping early can't turn a LIVE
+# result into LOW.
+EARLY_EXIT_MOTION = 1.0
+
+
+def open_camera(camera_index: int = 0) -> Optional[cv2.VideoCapture]:
     """
-    Capture frames from webcam with delays to ensure motion is captured.
+    Open a camera and configure it for motion capture.
     
     Args:
         camera_index: Camera device index
-        num_frames: Number of frames to capture
-        delay_ms: Delay in milliseconds between frames (default 100ms)
         
     Returns:
-        List of frames (numpy arrays) or None if camera unavailable
+        Opened VideoCapture (already warmed up) or None if camera unavailable
     """
-    import time
-    
     cap = cv2.VideoCapture(camera_index)
     
     if not cap.isOpened():
+        cap.release()
         return None
     
     # Set camera properties for better capture
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
     # Increase exposure/gain sensitivity if supported
     try:
         cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25)  # Manual exposure for consistency
     except:
         pass  # Some cameras don't support this
     
-    frames = []
+    # Ask for raw YUYV so the Y plane can be used as grayscale directly,
+    # skipping the YUV->BGR->GRAY conversions. Only disable OpenCV's RGB
+    # conversion if the camera actually accepted the format.
+    yuyv = cv2.VideoWriter_fourcc(*'YUYV')
+    cap.set(cv2.CAP_PROP_FOURCC, yuyv)
+    if int(cap.get(cv2.CAP_PROP_FOURCC)) == yuyv:
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    
+    # Keep the driver queue short: a held-open camera isn't read between
+    # captures, so queued frames go stale (not every backend honours this,
+    # see _drain_stale_frames)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     
     # Discard first few frames to let camera adjust
     for _ in range(2):  # Reduced from 3 to capture faster
         cap.read()
     
+    return cap
+
+
+def capture_frames(camera_index: int = 0, num_frames: int = 4, delay_ms: int = 100,
+                   cap: Optional[cv2.VideoCapture] = None) -> Optional[list[np.ndarray]]:
+    """
+    Capture frames from webcam with delays to ensure motion is captured.
+    
+    Args:
+        camera_index: Camera device index
+        num_frames: Number of frames to capture
+        delay_ms: Delay in milliseconds between frames (default 100ms)
+        cap: Already-open capture to read from (see open_camera). It is left
+            open for reuse; if omitted the camera is opened and released here.
+        
+    Returns:
+        List of frames (numpy arrays) or None if camera unavailable
+    """
+    owns_cap = cap is None
+    if owns_cap:
+        cap = open_camera(camera_index)
+        if cap is None:
+            return None
+    else:
+        # A reused capture has frames queued since its last use
+        _drain_stale_frames(cap)
+    
+    # Space frames by whole camera frames instead of sleeping: grab() just
+    # advances the driver buffer (no decode) and blocks at the camera's
+    # frame rate, and only the frames we keep are decoded via retrieve().
+    # At least 150ms apart to ensure fish movement is captured.
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps <= 0:
+        fps = 30.0
+    grabs_per_frame = max(1, math.ceil(max(delay_ms, 150) * fps / 1000.0))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    frames = []
+    
     for i in range(num_frames):
-        ret, frame = cap.read()
+        if i > 0:
+            # Skip the frames between samples without decoding them
+            for _ in range(grabs_per_frame - 1):
+                if not cap.grab():
+                    break
+        if not cap.grab():
+            break
+        ret, frame = cap.retrieve()
         if not ret:
             break
         
         # Convert to grayscale for motion detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frames.append(gray)
-        
-        # Add delay between frames to capture actual motion
-        # Slightly longer delay (150ms) to ensure fish movement is captured
-        if i < num_frames - 1:  # Don't delay after last frame
-            time.sleep(max(delay_ms, 150) / 1000.0)  # At least 150ms for fish movement
+        frames.append(_to_gray(frame, width, height))
     
-    cap.release()
+    if owns_cap:
+        cap.release()
     return frames if len(frames) == num_frames else None
 
 
-def compute_motion_entropy(frames: list[np.ndarray]) -> Tuple[bytes, float]:
+def _drain_stale_frames(cap: cv2.VideoCapture):
+    """
+    Discard frames the driver queued while nobody was reading the camera.
+    
+    Otherwise the first captured frame could be from the end of the previous
+    capture, and motion would be measured against that old frame.
+    """
+    buffered = int(cap.get(cv2.CAP_PROP_BUFFERSIZE))
+    if buffered <= 0:
+        buffered = 4  # OpenCV's default V4L2 queue depth
+    for _ in range(buffered):
+        if not cap.grab():
+            break
+
+
+def _to_gray(frame: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Get the grayscale image from a captured frame.
+    
+    For YUYV captures (see open_camera) this is a view of the Y samples, with
+    no conversion pass; BGR frames fall back to cvtColor.
+    """
+    if frame.ndim == 3 and frame.shape[2] == 2:
+        # Packed YUYV as (H, W, 2): Y is channel 0
+        return frame[:, :, 0]
+    if frame.ndim != 3 and frame.size == width * height * 2:
+        # Raw YUYV buffer, as some backends return with RGB conversion off
+        return frame.reshape(height, width, 2)[:, :, 0]
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+def compute_motion_entropy(frames: list[np.ndarray], nonce: Optional[bytes] = None) -> Tuple[bytes, float]:
     """
     Compute entropy from frame differences (motion detection).
-    Uses improved algorithm with Gaussian blur and thresholding for better sensitivity.
+    Frames are differenced directly; at the low capture resolution the
+    camera's own downscaling already smooths out most pixel noise.
     
     Args:
         frames: List of grayscale frames
+        nonce: Per-call unique bytes mixed into the hash (e.g. from
+               KMSState.next_nonce_bytes); 4 random bytes if not given
         
     Returns:
         Tuple of (entropy_bytes, motion_score)
         motion_score: Average pixel difference across frames (0-255 scale)
     """
+    if nonce is None:
+        nonce = os.urandom(4)
+    
     if len(frames) < 2:
         # If only one frame, use frame noise as entropy
-        frame = frames[0]
-        diff = frame.astype(np.float32)
-        motion_score = np.std(diff)
+        frame = np.ascontiguousarray(frames[0], dtype=np.uint8)
+        motion_score = np.std(frame)
         # Include timestamp + nonce so each capture produces a different hash
-        entropy_bytes = hashlib.sha256(diff.tobytes() + struct.pack('d', time.time()) + os.urandom(4)).digest()
+        # (fed to the hash piecewise, straight from the frame buffer, to
+        # avoid copying or concatenating a frame-sized buffer)
+        h = hashlib.sha256()
+        h.update(memoryview(frame))
+        h.update(struct.pack('d', time.time()))
+        h.update(nonce)
+        entropy_bytes = h.digest()
         return entropy_bytes, float(motion_score)
     
-    # Apply minimal blur to reduce noise while preserving fine motion details
-    # Smaller kernel (3x3) is more sensitive to small movements
-    blurred_frames = [cv2.GaussianBlur(frame, (3, 3), 0) for frame in frames]
+    # Frames are differenced into a preallocated uint8 stack, one pair at
+    # a time so we can stop as soon as motion is obvious.
+    num = len(frames)
+    diffs = np.empty((num - 1,) + frames[0].shape, dtype=np.uint8)
     
-    # Compute frame differences with more sensitivity
-    diffs = []
-    for i in range(1, len(blurred_frames)):
-        diff = cv2.absdiff(blurred_frames[i-1], blurred_frames[i])
+    pairs = 0
+    motion_sum = 0.0
+    for i in range(1, num):
+        diff = cv2.absdiff(frames[i - 1], frames[i], dst=diffs[i - 1])
         # Lower threshold (5 instead of 10) to detect smaller movements
-        # Use adaptive thresholding for better sensitivity
-        diff_enhanced = cv2.multiply(diff, 1.5)  # Enhance differences
-        diff_enhanced = np.clip(diff_enhanced, 0, 255).astype(np.uint8)
-        diffs.append(diff_enhanced)
+        # Enhance differences (x1.5, rounded, saturated at 255) in place
+        cv2.convertScaleAbs(diff, dst=diff, alpha=1.5)
+        pairs = i
+        
+        # Liveness only needs to clear a threshold: once the running mean
+        # alone puts the score above it (over at least 2 pairs), the
+        # remaining pairs can't change the outcome, so skip them
+        motion_sum += cv2.mean(diff)[0]
+        if pairs >= 2 and MOTION_MEAN_WEIGHT * motion_sum / pairs > EARLY_EXIT_MOTION:
+            break
     
-    # Average motion across all frame pairs
-    avg_diff = np.mean(diffs, axis=0)
+    # Average motion across the frame pairs we processed
+    avg_diff = diffs[:pairs].mean(axis=0, dtype=np.float32)
     
     # Calculate motion score using multiple methods for better accuracy
-    mean_motion = np.mean(avg_diff)
-    median_motion = np.median(avg_diff)
-    std_motion = np.std(avg_diff)
-    max_motion = np.max(avg_diff)  # Peak motion value
+    mean, std = cv2.meanStdDev(avg_diff)
+    mean_motion = mean[0, 0]
+    std_motion = std[0, 0]
+    max_motion = cv2.minMaxLoc(avg_diff)[1]  # Peak motion value
     
     # More sensitive calculation: emphasize mean and variance
     # Include max motion to catch even brief movements
-    motion_score = mean_motion + (std_motion * 0.5) + (max_motion * 0.1)
+    motion_score = (mean_motion * MOTION_MEAN_WEIGHT) + (std_motion * 0.5) + (max_motion * 0.1)
     
     # Generate entropy from differences; include timestamp + nonce so each
     # capture produces a different hash (motion data + time + nonce ensures uniqueness)
-    diff_bytes = avg_diff.astype(np.uint8).tobytes()
-    entropy_bytes = hashlib.sha256(diff_bytes + struct.pack('d', time.time()) + os.urandom(4)).digest()
+    h = hashlib.sha256()
+    h.update(memoryview(np.ascontiguousarray(avg_diff, dtype=np.uint8)))
+    h.update(struct.pack('d', time.time()))
+    h.update(nonce)
+    entropy_bytes = h.digest()
     
     return entropy_bytes, float(motion_score)
 